@@ -4,13 +4,14 @@ import re
 import os
 import sys
 import argparse
-import csv
 from dateutil.parser import parse
 from datetime import datetime
 from pandas import Series
 from pandas.errors import ParserError
 from utils import sanitize_pg_table_name, sanitize_pg_column_name, \
-    is_missing, clean_cell, guess_column_type, CUSTOM_NA_VALUES
+    clean_column, encode_low_cardinality, guess_column_type, format_insert_batches, \
+    WarningReporter, check_column_counts, build_row_index, load_row_index, save_row_index, \
+    CUSTOM_NA_VALUES, READ_CSV_OPTIONS, ChunkReader, BackgroundWriter
 
 # python converter.py "c:/example/combination.csv" [--no-header]
 # python converter.py combination.csv [--no-header]
@@ -19,7 +20,17 @@ from utils import sanitize_pg_table_name, sanitize_pg_column_name, \
 parser = argparse.ArgumentParser(description="CSV to PostgreSQL converter")
 parser.add_argument("csv_file", type=str, help="Path to the CSV file")
 parser.add_argument('--no-header', action='store_true', help='Set this flag if CSV file does NOT have a header row')
+parser.add_argument('--save-index', action='store_true', help='Save the row offset index next to the CSV file')
+parser.add_argument('--pipeline', action='store_true',
+    help='Read and write in background threads, overlapping I/O with cleaning and formatting')
+parser.add_argument('--chunk-size', type=int, default=50000, help='Number of rows per chunk and per INSERT batch')
+parser.add_argument('--queue-depth', type=int, default=4, help='Maximum number of chunks waiting in each pipeline queue')
 args = parser.parse_args()
+# Chunks and pipeline queues must hold at least one item
+if args.chunk_size < 1:
+    parser.error("--chunk-size must be at least 1")
+if args.queue_depth < 1:
+    parser.error("--queue-depth must be at least 1")
 
 # File name can be full path or file name
 # If inputting file name, the program will look for the file in the current path
@@ -44,32 +55,50 @@ start_time = datetime.now()
 print(f"\033[92m[START] Conversion started at {start_time.strftime('%Y-%m-%d %H:%M:%S')}\033[0m")
 
 # Check if CSV file column mismatch
-with open(csv_path, newline='', encoding='utf-8') as f:
-    column_mismatch = False
-    reader = csv.reader(f)
-    expected_cols = len(next(reader))
-    for i, row in enumerate(reader, start=2):
-        if len(row) != expected_cols:
-            print(f"\033[91m[ERROR] Line {i}: Expected {expected_cols} columns but found {len(row)} columns\033[0m")
-            column_mismatch = True
-    if column_mismatch:
+# The row offset index is only built when it's saved or read by the pipeline
+# A saved index that is still up to date means the file was already checked
+row_offsets = load_row_index(csv_path)
+if row_offsets is None:
+    if args.save_index or args.pipeline:
+        row_offsets, expected_cols, mismatches = build_row_index(csv_path)
+    else:
+        expected_cols, mismatches = check_column_counts(csv_path)
+    for i, found_cols in mismatches:
+        print(f"\033[91m[ERROR] Line {i}: Expected {expected_cols} columns but found {found_cols} columns\033[0m")
+    if mismatches:
         print(f"\033[91m[ERROR] Column count mismatch detected. Aborting.\033[0m")
         sys.exit(1)
+    if args.save_index:
+        save_row_index(csv_path, row_offsets)
 
 # Generate SQL file
-with open(sql_output_path, "w", encoding="utf-8") as tf:
+# The pipeline writes large batches, so give the file a large buffer too
+with open(sql_output_path, "w", encoding="utf-8", buffering=(1 << 20) if args.pipeline else -1) as tf:
 
     csv_path = args.csv_file 
     try:
-        if args.no_header:
-            df = pd.read_csv(csv_path, header=None,
-                na_values=list(CUSTOM_NA_VALUES), keep_default_na=True, dtype=str,
-                sep=",", quotechar='"', encoding="utf-8", skipinitialspace=True)
+        if args.pipeline:
+            # The reader thread prefetches the next chunks while this thread cleans the current one.
+            # Only reading overlaps cleaning here: the column types are guessed from the whole file,
+            # so every cleaned chunk is kept and combined into one table, which briefly needs
+            # about twice the memory of the cleaned data.
+            reader = ChunkReader(csv_path, row_offsets, args.chunk_size, not args.no_header, args.queue_depth)
+            chunks = []
+            for chunk in reader:
+                for col in chunk.columns:
+                    chunk[col] = clean_column(chunk[col])
+                chunks.append(chunk)
+            # Chunks are read without the header row, take the column names from it
+            header = None if args.no_header else pd.read_csv(csv_path, nrows=0, **READ_CSV_OPTIONS).columns
+            df = pd.concat(chunks) if chunks else pd.DataFrame(columns=header, dtype=str)
+            # Release the chunks once they are combined
+            del chunks
+            df.columns = [f"Column{i+1}" for i in range(df.shape[1])] if args.no_header else header
+        elif args.no_header:
+            df = pd.read_csv(csv_path, header=None, **READ_CSV_OPTIONS)
             df.columns = [f"Column{i+1}" for i in range(df.shape[1])]
         else:
-            df = pd.read_csv(csv_path,
-                na_values=list(CUSTOM_NA_VALUES), keep_default_na=True, dtype=str,
-                sep=",", quotechar='"', encoding="utf-8", skipinitialspace=True)
+            df = pd.read_csv(csv_path, **READ_CSV_OPTIONS)
     except ParserError as e:
         print("\033[91m[ERROR] Failed to parse the CSV file.\033[0m")
         print("Please check the file for the following common issues:")
@@ -80,8 +109,10 @@ with open(sql_output_path, "w", encoding="utf-8") as tf:
         print(f"\033[91m[ERROR] Unexpected error while reading the file: {e}\033[0m")
         exit(1)
     
+    # Clean each column in one vectorized pass, NA values become None
+    # Low-cardinality columns are then dictionary-encoded as pandas category
     for col in df.columns:
-        df[col] = df[col].map(clean_cell).map(lambda x: None if is_missing(x) else x)
+        df[col] = encode_low_cardinality(df[col] if args.pipeline else clean_column(df[col]))
     
     # Clean table name
     table_name: str = sanitize_pg_table_name(source_table)
@@ -97,106 +128,40 @@ with open(sql_output_path, "w", encoding="utf-8") as tf:
     # Format column names
     df.columns = [sanitize_pg_column_name(col) for col in df.columns]
 
+    # Warnings of this conversion, printed once the column types are guessed
+    reporter = WarningReporter()
+
     for column_name in df.columns:
-        column_type: str = guess_column_type(df[column_name], not args.no_header)
+        column_type: str = guess_column_type(df[column_name], not args.no_header, cleaned=True,
+                                             reporter=reporter)
         sql_create_table += f'    {column_name} {column_type},\n'
         column_names.append(f'{column_name}')
         column_types.append(column_type)
 
     sql_create_table = sql_create_table.rstrip(",\n") + "\n);\n"
+    reporter.report()
+
+    # The writer thread writes each batch while this thread formats the next one
+    writer = BackgroundWriter(tf, args.queue_depth) if args.pipeline else tf
 
     # Generate DDL statement
-    tf.write(sql_create_table)
+    writer.write(sql_create_table)
     
     # Generate DML insert statement
-    sql_insert_data = f"INSERT INTO {table_name} ({', '.join(column_names)}) VALUES \n"
+    writer.write(f"INSERT INTO {table_name} ({', '.join(column_names)}) VALUES \n")
 
-    # Use list to store values and join them later for efficiency
-    value_list = []
-    
     # Convert data values or format according to target column data type
-    # Iterator every row in the CSV
-    for row in df.itertuples(index=False, name=None):
-        values = []
-        # Iterator every column in the row
-        for i in range(len(df.columns)):
-            # If the value is in NA values list, replace this value with NULL  
-            if is_missing(row[i]):
-                values.append("NULL")
-                continue
-            if column_types[i] == "TIMETZ":
-                time_val = pd.to_datetime(row[i], errors='coerce')
-                if pd.notna(time_val):
-                    if time_val.tzinfo is None:
-                        time_val = time_val.tz_localize('UTC')
-                    formatted_time = time_val.strftime('%H:%M:%S%z')
-                    tz_part = formatted_time[-5:]
-                    tz_with_colon = tz_part[:3] + ":" + tz_part[3:]
-                    formatted_time = formatted_time[:-5] + tz_with_colon
-                    values.append(f"'{formatted_time}'")
-                else:
-                    values.append('NULL')
-            elif column_types[i] == "TIME":
-                time_val = pd.to_datetime(row[i], errors='coerce')
-                if pd.notna(time_val):
-                    if time_val.tzinfo is not None:
-                        time_val = time_val.tz_convert('UTC').replace(tzinfo=None)
-                    formatted_time = time_val.strftime('%H:%M:%S')
-                    values.append(f"'{formatted_time}'")
-                else:
-                    values.append('NULL')
-            elif column_types[i] == "DATE":                
-                # By default it's day-first, unless the date starts with "yyyy"
-                if re.match(r'^\d{4}', row[i]):
-                    date_val = pd.to_datetime(row[i], errors='coerce', dayfirst=False)
-                else:
-                    date_val = pd.to_datetime(row[i], errors='coerce', dayfirst = True)
-                values.append(f"'{date_val.date()}'" if pd.notna(date_val) else 'NULL')
-            elif column_types[i] == "TIMESTAMPTZ":
-                timestamp_val = pd.to_datetime(row[i], errors='coerce')
-                if pd.notna(timestamp_val):
-                    if timestamp_val.tzinfo is None:
-                        timestamp_val = timestamp_val.tz_localize('UTC')
-                    else:
-                        timestamp_val = timestamp_val.tz_convert('UTC')
-                    # formatted_timestamp = timestamp_val.strftime('%Y-%m-%d %H:%M:%S %z')
-                    # formatted_timestamp = timestamp_val.strftime('%Y-%m-%d %H:%M:%S.%f %z')[:29]
-                    formatted_timestamp = timestamp_val.isoformat(timespec='microseconds')
-                    values.append(f"'{formatted_timestamp}'")
-                else:
-                    values.append('NULL')
-            elif column_types[i] == "TIMESTAMP":    
-                # By default it's day-first, unless the date starts with "yyyy"
-                if re.match(r'^\d{4}', row[i]):                    
-                    timestamp_val = pd.to_datetime(row[i], errors='coerce', dayfirst=False)
-                else:
-                    timestamp_val = pd.to_datetime(row[i], errors='coerce', dayfirst = True)
-                if pd.notna(timestamp_val):
-                    # formatted_timestamp = timestamp_val.strftime('%Y-%m-%d %H:%M:%S.%f')[:23]
-                    formatted_timestamp = timestamp_val.strftime('%Y-%m-%d %H:%M:%S.%f')
-                    values.append(f"'{formatted_timestamp}'")
-                else:
-                    values.append('NULL')
-            elif column_types[i] in ("INTEGER", "BIGINT", "NUMERIC"):
-                val = str(row[i]).replace(",", "").strip()
-                values.append(f"'{val}'")
-            elif column_types[i] == "BOOLEAN":
-                val = str(row[i]).strip().lower()
-                if val in ("true", "t", "yes", "y", "1"):
-                    values.append("TRUE")
-                elif val in ("false", "f", "no", "n", "0"):
-                    values.append("FALSE")
-                else:
-                    values.append("NULL")
-            else:
-                val = str(row[i]).replace("'", "''")
-                values.append(f"'{val}'")
-        value_list.append(f"({', '.join(values)})")
-
-    sql_insert_data += ",\n".join(value_list) + ";\n"
+    # Format column by column in batches, categorical columns are formatted once per distinct value
+    for batch in format_insert_batches(df, column_types, args.chunk_size):
+        writer.write(batch)
 
     # Write DML
-    tf.write(sql_insert_data)
+    writer.write(";\n")
+
+    if args.pipeline:
+        writer.close()
+        reader.queue.report()
+        writer.queue.report()
 
     end_time = datetime.now()
     duration = (end_time - start_time).total_seconds()
@@ -1,6 +1,14 @@
 import pandas as pd
+import numpy as np
 import re
+import os
+import io
+import csv
+import time
+import queue
+import threading
 import warnings
+from array import array
 from dateutil.parser import parse
 from datetime import datetime
 from pandas import Series
@@ -14,10 +22,66 @@ WEEKDAY_VALUES = (r"(Sunday|Sun|Monday|Mon|Tuesday|Tue|Wednesday|Wed|Thursday|Th
 MONTH_VALUES = (r"(January|Jan|February|Feb|March|Mar|April|Apr|May|June|Jun|July|"
     r"Jul|August|Aug|September|Sep|October|Oct|November|Nov|December|Dec)")     
 
-# Warnings, to ensure the warning not to be duplicated for the same value. 
 warnings.filterwarnings("ignore", category=UserWarning)
-warnings = []
-already_warned = set()
+
+# Options of pd.read_csv shared by every reader of the CSV file
+READ_CSV_OPTIONS = dict(na_values=list(CUSTOM_NA_VALUES), keep_default_na=True, dtype=str,
+    sep=",", quotechar='"', encoding="utf-8", skipinitialspace=True)
+
+# Options of csv.reader splitting the records the same way as pd.read_csv with READ_CSV_OPTIONS
+CSV_READER_OPTIONS = dict(delimiter=READ_CSV_OPTIONS["sep"], quotechar=READ_CSV_OPTIONS["quotechar"],
+    skipinitialspace=READ_CSV_OPTIONS["skipinitialspace"])
+
+# Warning kinds, with the message and the hint printed for each of them
+WARNING_MESSAGES = {
+    "invalid_geometry": ("Invalid GEOMETRY format", ""),
+    "ambiguous_date": ("Ambiguous date format", " Day should not be in the middle."),
+}
+
+# Collect the warnings of one conversion, aggregated per column and warning kind.
+# Only the first max_examples values of each group are kept and printed,
+# the rest are counted. Reporters of parallel workers can be merged.
+class WarningReporter:
+    def __init__(self, max_examples: int = 5):
+        self.max_examples = max_examples
+        # (column name, kind) -> number of warnings
+        self.counts: dict[tuple, int] = {}
+        # (column name, kind) -> first (row number, value) pairs
+        self.examples: dict[tuple, list] = {}
+
+    # count: number of rows holding the value, when a distinct value is checked for all of them
+    def warn(self, kind: str, key: tuple, val: str, count: int = 1) -> None:
+        row_number, column_name = key
+        group = (column_name, kind)
+        self.counts[group] = self.counts.get(group, 0) + count
+        examples = self.examples.setdefault(group, [])
+        if len(examples) < self.max_examples:
+            examples.append((row_number, val))
+
+    def merge(self, other: "WarningReporter") -> "WarningReporter":
+        for group, count in other.counts.items():
+            self.counts[group] = self.counts.get(group, 0) + count
+            # Keep the examples of the lowest row numbers
+            examples = self.examples.get(group, []) + other.examples.get(group, [])
+            examples.sort(key=lambda example: example[0])
+            self.examples[group] = examples[:self.max_examples]
+        return self
+
+    def report(self) -> None:
+        for group, count in self.counts.items():
+            column_name, kind = group
+            message, hint = WARNING_MESSAGES[kind]
+            examples = self.examples[group]
+            for row_number, val in examples:
+                print(
+                    f"\033[93m[WARNING] {message} at row {row_number}, column '{column_name}', "
+                    f"value: '{val}'.{hint}\033[0m"
+                )
+            if count > len(examples):
+                print(
+                    f"\033[93m[WARNING] {message} in column '{column_name}': "
+                    f"{count - len(examples)} more values not shown, {count} in total.\033[0m"
+                )
 
 # Format target PostgreSQL table name
 def sanitize_pg_table_name(filename: str) -> str | None:
@@ -56,7 +120,7 @@ def is_geometry_wkb(val: str) -> bool:
         return False
 
 # Check if GEOMETRY is in WKT format
-def is_geometry_wkt(key: tuple, val: str) -> bool:
+def is_geometry_wkt(key: tuple, val: str, reporter: WarningReporter | None = None) -> bool:
     if not isinstance(val, str):
         return False
     try:
@@ -64,26 +128,24 @@ def is_geometry_wkt(key: tuple, val: str) -> bool:
         return True
     except Exception:
         if re.match(r"^\s*(POINT|LINESTRING|POLYGON|MULTIPOINT|MULTILINESTRING|MULTIPOLYGON|GEOMETRYCOLLECTION)\b", val, re.IGNORECASE):
-            if key and key not in already_warned:
-                print(
-                    f"\033[93m[WARNING] Invalid GEOMETRY format at row {key[0]}, column '{key[1]}', "
-                    f"value: '{val}'.\033[0m"
-                )
-                already_warned.add(key)
+            if key and reporter is not None:
+                reporter.warn("invalid_geometry", key, val)
         return False
 
-def is_geometry(key: tuple, val: str) -> bool:
-    return is_geometry_wkt(key, val) or is_geometry_wkb(val)
+def is_geometry(key: tuple, val: str, reporter: WarningReporter | None = None) -> bool:
+    return is_geometry_wkt(key, val, reporter) or is_geometry_wkb(val)
 
 # Check if the column is GEOMETRY type
-def is_geometry_column(column: pd.Series, has_header: bool = True) -> bool:
+# The check stops at the first invalid value, so it warns once per column at most
+def is_geometry_column(column: pd.Series, has_header: bool = True,
+                       reporter: WarningReporter | None = None) -> bool:
     non_null = column.dropna().astype(str)
     if non_null.empty:
         return False    
     for idx, val in non_null.items():
         row_number = idx + (2 if has_header else 1)
         key = (row_number, column.name)
-        if not is_geometry(key, val):
+        if not is_geometry(key, val, reporter):
             return False
     return True
 
@@ -108,13 +170,48 @@ def clean_cell(val):
         .replace('\u2029', '')
     )
 
+# Translate table removing the same invisible characters as clean_cell
+INVISIBLE_CHARS_TABLE = str.maketrans("", "", "\u00A0\u200B\uFEFF\u3000\u2028\u2029")
+
+# Clean the whole column at once, equivalent to mapping clean_cell and is_missing per cell
+def clean_column(column: Series) -> Series:
+    cleaned_col = column.str.strip(" \t\n\r").str.translate(INVISIBLE_CHARS_TABLE)
+    # NA mask for the whole column, built from CUSTOM_NA_VALUES
+    na_mask = cleaned_col.isna() | cleaned_col.str.strip().str.lower().isin(CUSTOM_NA_VALUES)
+    return cleaned_col.mask(na_mask, None)
+
+# Hold the column as pandas category if it has a handful of distinct values,
+# each repeated over many rows, so that type checks and SQL formatting run
+# once per distinct value
+LOW_CARDINALITY_MAX_VALUES = 256
+LOW_CARDINALITY_MAX_RATIO = 0.05
+def encode_low_cardinality(column: Series) -> Series:
+    non_null = column.dropna()
+    if non_null.empty:
+        return column
+    distinct_count = non_null.nunique()
+    if distinct_count > LOW_CARDINALITY_MAX_VALUES or distinct_count > len(non_null) * LOW_CARDINALITY_MAX_RATIO:
+        return column
+    return column.astype("category")
+
+# Distinct non-null values of the column, indexed by the row of their first occurrence,
+# and the number of rows holding each of them, with the same index
+def distinct_values(column: Series) -> tuple[Series, Series]:
+    values = column.dropna().astype(str)
+    distinct = values.drop_duplicates()
+    return distinct, distinct.map(values.value_counts())
+
 # Check if the column is VARCHAR or TEXT type
-def is_string_type(column: Series) -> str | None:
-    cleaned_col = column.dropna().astype(str).map(clean_cell).map(str.strip)
+# cleaned: True means the column has already been through clean_column
+def is_string_type(column: Series, cleaned: bool = False) -> str | None:
+    if cleaned:
+        cleaned_col = column.dropna().astype(str).str.strip()
+    else:
+        cleaned_col = column.dropna().astype(str).map(clean_cell).map(str.strip)
     cleaned_col = cleaned_col[~cleaned_col.isin(CUSTOM_NA_VALUES.union({""}))]        
     if cleaned_col.empty:
         return "TEXT"        
-    max_length = cleaned_col.map(len).max()
+    max_length = cleaned_col.str.len().max()
     if max_length <= 50:
         return "VARCHAR(50)" 
     elif max_length <= 100:
@@ -125,8 +222,8 @@ def is_string_type(column: Series) -> str | None:
         return "TEXT"
 
 # Verify if the value is DATE type by regular expression
-def check_date_pattern(key: tuple, val: str) -> bool:    
-    row_number, col_number = key            
+def check_date_pattern(key: tuple, val: str, reporter: WarningReporter | None = None,
+                       count: int = 1) -> bool:    
     date_patterns_digit = [
         # dd [-/.] mm [-/.] yy
         r"^(?P<day>\d{1,2})\s*([-/.]|\s)\s*(?P<month>\d{1,2})\s*([-/.]|\s)\s*(?P<year>\d{2})$",
@@ -143,13 +240,9 @@ def check_date_pattern(key: tuple, val: str) -> bool:
             day = int(parts["day"])
             month = int(parts["month"])             
             if not (month >= 1 and month <= 12) or not (day >= 1 and day <= 31):                     
-                if key not in already_warned:
-                    print(
-                        f"\033[93m[WARNING] Ambiguous date format at row {row_number}, column '{col_number}', "
-                        f"value: '{val}'. Day should not be in the middle.\033[0m"
-                    )
-                    already_warned.add(key)
-                    return False
+                if reporter is not None:
+                    reporter.warn("ambiguous_date", key, val, count)
+                return False
             return True
     # Check if the value match the rest of correct DATE format.
     # textual weekday and textual month      
@@ -177,8 +270,8 @@ def check_date_pattern(key: tuple, val: str) -> bool:
 # Verify if the value is TIMESTAMP or TIMESTAMPTZ type by regular expression
 # check_tz: True means checking if the value is TIMESTAMPTZ
 #           False means checking if the value is TIMESTAMP
-def check_timestamp_pattern(key: tuple, val: str, check_tz: bool) -> bool:
-    row_number, col_number = key
+def check_timestamp_pattern(key: tuple, val: str, check_tz: bool,
+                            reporter: WarningReporter | None = None, count: int = 1) -> bool:
     # hh:mm:ss[.sss] or hh:mm or hh
     hh_mm_ss = r"\s*(\d{1,2})(:(\d{1,2}))?(:(\d{1,2})(\.\d+)?)?"
     tz = r"(?:Z|[+-]\d{2}(?::?\d{2}))"
@@ -211,13 +304,9 @@ def check_timestamp_pattern(key: tuple, val: str, check_tz: bool) -> bool:
             day = int(parts["day"])
             month = int(parts["month"])
             if not (month >= 1 and month <= 12) or not (day >= 1 and day <= 31):
-                if key not in already_warned:
-                    print(
-                        f"\033[93m[WARNING] Ambiguous date format at row {row_number}, column '{col_number}', "
-                        f"value: '{val}'. Day should not be in the middle.\033[0m"
-                    )
-                    already_warned.add(key)
-                    return False
+                if reporter is not None:
+                    reporter.warn("ambiguous_date", key, val, count)
+                return False
             return True    
     return False
 
@@ -243,7 +332,10 @@ def check_time_pattern(key: tuple, val: str, check_tz: bool) -> bool:
     return False
 
 # Check if the column is DATE or TAMESTAMP or TIME type
-def is_date_time_column(column: Series, has_header: bool = True) -> str | None:
+# row_counts: number of rows holding each value, indexed like the column
+def is_date_time_column(column: Series, has_header: bool = True,
+                        reporter: WarningReporter | None = None,
+                        row_counts: Series | None = None) -> str | None:
     total_non_null = column.dropna().shape[0]
     if total_non_null == 0:
         return None
@@ -263,10 +355,7 @@ def is_date_time_column(column: Series, has_header: bool = True) -> str | None:
         # Get the row number
         row_number = idx + (2 if has_header else 1)
         key = (row_number, column.name) 
-        # If there is already warning for this value, stop checking           
-        if key in already_warned:
-            found_invalid = True
-            continue               
+        count = 1 if row_counts is None else int(row_counts[idx])
         val = val.strip()    
         # Check if all the value is time period format, for example 00:00-01:00
         period_pattern = r"^\d{1,2}:\d{1,2}\s*-\s*\d{1,2}:\d{1,2}$"
@@ -278,11 +367,11 @@ def is_date_time_column(column: Series, has_header: bool = True) -> str | None:
             parse(val, fuzzy=False)
             # print("PASS")
             # Check further by regular expression
-            if check_timestamp_pattern(key, val, True) == True:
+            if check_timestamp_pattern(key, val, True, reporter, count) == True:
                 contains_timestamptz = True
-            elif check_timestamp_pattern(key, val, False) == True: 
+            elif check_timestamp_pattern(key, val, False, reporter, count) == True: 
                 contains_timestamp = True 
-            elif check_date_pattern(key, val) == True:
+            elif check_date_pattern(key, val, reporter, count) == True:
                 contains_date = True
             elif check_time_pattern(key, val, True) == True:
                 contains_timetz = True
@@ -335,13 +424,16 @@ def is_boolean_column(column: Series) -> bool:
     return column_str.isin(valid_boolean_values).all()
 
 # Check if the column is INTEGER or NUMERIC type
-def is_numeric_column(column: pd.Series) -> str | None:
+# cleaned: True means the column has already been through clean_column
+def is_numeric_column(column: pd.Series, cleaned: bool = False) -> str | None:
     parsed_values = []
     is_date_column = True
     is_credit_card_column = True
-    for val in column:
+    # NA values are already removed from a cleaned column
+    values = column.dropna() if cleaned else column
+    for val in values:
         # Ignore NA values 
-        if pd.isna(val) or str(val).strip().lower() in CUSTOM_NA_VALUES:
+        if not cleaned and (pd.isna(val) or str(val).strip().lower() in CUSTOM_NA_VALUES):
             continue          
         val_str = str(val).strip()  
         # If the value starts with 0, the type should be VARCHAR or TEXT
@@ -389,18 +481,350 @@ def is_numeric_column(column: pd.Series) -> str | None:
     return "NUMERIC"
 
 # Guess column type
-def guess_column_type(column: Series, has_header: bool = True) -> str | None:
-    if is_geometry_column(column):
+# cleaned: True means the column has already been through clean_column
+# reporter: collects the warnings of the current conversion
+def guess_column_type(column: Series, has_header: bool = True, cleaned: bool = False,
+                      reporter: WarningReporter | None = None) -> str | None:
+    # Every check only depends on the set of values, so a categorical column
+    # is checked once per distinct value. Warnings then refer to the first row of each value,
+    # and ambiguous dates are counted once per row holding the value.
+    row_counts = None
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        column, row_counts = distinct_values(column)
+    if is_geometry_column(column, reporter=reporter):
         return "GEOMETRY"
-    numeric_type = is_numeric_column(column)
+    numeric_type = is_numeric_column(column, cleaned=cleaned)
     if numeric_type != None:
         return numeric_type
     if pd.api.types.is_bool_dtype(column) or is_boolean_column(column):
         return "BOOLEAN"
     if pd.api.types.is_object_dtype(column) or pd.api.types.is_string_dtype(column):            
-        datetime_type = is_date_time_column(column, has_header=has_header)
+        datetime_type = is_date_time_column(column, has_header=has_header, reporter=reporter,
+                                             row_counts=row_counts)
         if datetime_type != None:
             return datetime_type      
         else:
-            return is_string_type(column)
-    return "TEXT"
\ No newline at end of file
+            return is_string_type(column, cleaned=cleaned)
+    return "TEXT"
+
+# Format one value as a SQL literal according to the target column data type
+def format_sql_value(val, column_type: str) -> str:
+    # If the value is in NA values list, replace this value with NULL
+    if is_missing(val):
+        return "NULL"
+    if column_type == "TIMETZ":
+        time_val = pd.to_datetime(val, errors='coerce')
+        if pd.notna(time_val):
+            if time_val.tzinfo is None:
+                time_val = time_val.tz_localize('UTC')
+            formatted_time = time_val.strftime('%H:%M:%S%z')
+            tz_part = formatted_time[-5:]
+            tz_with_colon = tz_part[:3] + ":" + tz_part[3:]
+            formatted_time = formatted_time[:-5] + tz_with_colon
+            return f"'{formatted_time}'"
+        else:
+            return 'NULL'
+    elif column_type == "TIME":
+        time_val = pd.to_datetime(val, errors='coerce')
+        if pd.notna(time_val):
+            if time_val.tzinfo is not None:
+                time_val = time_val.tz_convert('UTC').replace(tzinfo=None)
+            formatted_time = time_val.strftime('%H:%M:%S')
+            return f"'{formatted_time}'"
+        else:
+            return 'NULL'
+    elif column_type == "DATE":
+        # By default it's day-first, unless the date starts with "yyyy"
+        if re.match(r'^\d{4}', val):
+            date_val = pd.to_datetime(val, errors='coerce', dayfirst=False)
+        else:
+            date_val = pd.to_datetime(val, errors='coerce', dayfirst = True)
+        return f"'{date_val.date()}'" if pd.notna(date_val) else 'NULL'
+    elif column_type == "TIMESTAMPTZ":
+        timestamp_val = pd.to_datetime(val, errors='coerce')
+        if pd.notna(timestamp_val):
+            if timestamp_val.tzinfo is None:
+                timestamp_val = timestamp_val.tz_localize('UTC')
+            else:
+                timestamp_val = timestamp_val.tz_convert('UTC')
+            # formatted_timestamp = timestamp_val.strftime('%Y-%m-%d %H:%M:%S %z')
+            # formatted_timestamp = timestamp_val.strftime('%Y-%m-%d %H:%M:%S.%f %z')[:29]
+            formatted_timestamp = timestamp_val.isoformat(timespec='microseconds')
+            return f"'{formatted_timestamp}'"
+        else:
+            return 'NULL'
+    elif column_type == "TIMESTAMP":
+        # By default it's day-first, unless the date starts with "yyyy"
+        if re.match(r'^\d{4}', val):
+            timestamp_val = pd.to_datetime(val, errors='coerce', dayfirst=False)
+        else:
+            timestamp_val = pd.to_datetime(val, errors='coerce', dayfirst = True)
+        if pd.notna(timestamp_val):
+            # formatted_timestamp = timestamp_val.strftime('%Y-%m-%d %H:%M:%S.%f')[:23]
+            formatted_timestamp = timestamp_val.strftime('%Y-%m-%d %H:%M:%S.%f')
+            return f"'{formatted_timestamp}'"
+        else:
+            return 'NULL'
+    elif column_type in ("INTEGER", "BIGINT", "NUMERIC"):
+        val = str(val).replace(",", "").strip()
+        return f"'{val}'"
+    elif column_type == "BOOLEAN":
+        val = str(val).strip().lower()
+        if val in ("true", "t", "yes", "y", "1"):
+            return "TRUE"
+        elif val in ("false", "f", "no", "n", "0"):
+            return "FALSE"
+        else:
+            return "NULL"
+    else:
+        val = str(val).replace("'", "''")
+        return f"'{val}'"
+
+# SQL literals of every category of the column, followed by NULL.
+# Missing values have code -1, which picks the trailing NULL.
+def category_literals(column: Series, column_type: str) -> np.ndarray:
+    literals = [format_sql_value(val, column_type) for val in column.cat.categories]
+    return np.array(literals + ["NULL"], dtype=object)
+
+# Format every value of the column as a SQL literal.
+# A categorical column is formatted once per category and gathered by code.
+def format_column(column: Series, column_type: str, literals: np.ndarray | None = None) -> list:
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        if literals is None:
+            literals = category_literals(column, column_type)
+        return literals[column.cat.codes.to_numpy()].tolist()
+    return [format_sql_value(val, column_type) for val in column]
+
+# Format the rows of the INSERT statement in batches of chunk_size rows.
+# Joining the batches gives the same text as formatting all the rows at once.
+def format_insert_batches(df: pd.DataFrame, column_types: list, chunk_size: int):
+    # Categories are formatted once for the whole column, not once per batch
+    literals = {
+        column_name: category_literals(df[column_name], column_types[i])
+        for i, column_name in enumerate(df.columns)
+        if isinstance(df[column_name].dtype, pd.CategoricalDtype)
+    }
+    for start in range(0, len(df), chunk_size):
+        part = df.iloc[start:start + chunk_size]
+        formatted_columns = [format_column(part[column_name], column_types[i], literals.get(column_name))
+                             for i, column_name in enumerate(part.columns)]
+        value_list = [f"({', '.join(values)})" for values in zip(*formatted_columns)]
+        yield (",\n" if start else "") + ",\n".join(value_list)
+
+# Check the column count of every record against the first one, without building the row index.
+# Returns the expected column count and the (line, column count) of mismatched records.
+def check_column_counts(csv_path: str) -> tuple[int, list]:
+    mismatches = []
+    expected_cols = 0
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f, **CSV_READER_OPTIONS)
+        for i, row in enumerate(reader, start=1):
+            if i == 1:
+                expected_cols = len(row)
+            elif len(row) != expected_cols:
+                mismatches.append((i, len(row)))
+    return expected_cols, mismatches
+
+# Line endings accepted by csv.reader, same as reading the file with newline=''
+LINE_END_PATTERN = re.compile(rb"\r\n|\r|\n")
+
+# Decode the binary lines of the file for csv.reader, recording the byte offset of each line.
+# Lines end with \r\n, \r or \n, the file is read in blocks of block_size bytes.
+def _decode_lines(f, line_offsets: array, block_size: int = 1 << 20):
+    offset = 0
+    pending = b""
+    while True:
+        block = f.read(block_size)
+        data = pending + block
+        start = 0
+        for match in LINE_END_PATTERN.finditer(data):
+            # A \r at the end of the block may be followed by \n in the next block
+            if block and match.end() == len(data) and data.endswith(b"\r"):
+                break
+            line = data[start:match.end()]
+            line_offsets.append(offset)
+            offset += len(line)
+            yield line.decode("utf-8")
+            start = match.end()
+        pending = data[start:]
+        if not block:
+            break
+    # Last line without line ending
+    if pending:
+        line_offsets.append(offset)
+        offset += len(pending)
+        yield pending.decode("utf-8")
+    # Offset of the end of the file
+    line_offsets.append(offset)
+
+# Build the row index of the CSV file: the byte offset where each record starts,
+# header included, followed by the end-of-file offset. Quoted values containing
+# newlines stay in one record because the records are split by csv.reader,
+# with the same quoting rules as pd.read_csv.
+# Also returns the expected column count and the (line, column count) of mismatched records.
+def build_row_index(csv_path: str) -> tuple[np.ndarray, int, list]:
+    line_offsets = array("q")
+    record_lines = array("q")
+    mismatches = []
+    expected_cols = 0
+    with open(csv_path, "rb") as f:
+        reader = csv.reader(_decode_lines(f, line_offsets), **CSV_READER_OPTIONS)
+        line_num = 0
+        for i, row in enumerate(reader, start=1):
+            record_lines.append(line_num)
+            line_num = reader.line_num
+            if i == 1:
+                expected_cols = len(row)
+            elif len(row) != expected_cols:
+                mismatches.append((i, len(row)))
+        # The end-of-file offset closes the last record
+        record_lines.append(len(line_offsets) - 1)
+    offsets = np.asarray(line_offsets, dtype=np.int64)[np.asarray(record_lines, dtype=np.int64)]
+    return offsets, expected_cols, mismatches
+
+# The row index is saved next to the CSV file
+def row_index_path(csv_path: str) -> str:
+    return os.path.splitext(csv_path)[0] + ".idx.npy"
+
+def save_row_index(csv_path: str, offsets: np.ndarray) -> None:
+    np.save(row_index_path(csv_path), offsets)
+
+# Load the saved row index, None if it's missing, unreadable or the CSV file changed since
+def load_row_index(csv_path: str) -> np.ndarray | None:
+    index_path = row_index_path(csv_path)
+    if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(csv_path):
+        return None
+    try:
+        offsets = np.load(index_path)
+    except Exception:
+        return None
+    if offsets.ndim != 1 or not np.issubdtype(offsets.dtype, np.integer) \
+        or len(offsets) == 0 or offsets[-1] != os.path.getsize(csv_path):
+        return None
+    return offsets
+
+# Number of data rows in the row index
+def row_count(offsets: np.ndarray, has_header: bool = True) -> int:
+    return max(len(offsets) - 1 - (1 if has_header else 0), 0)
+
+# Read the data rows [start, stop) by seeking straight to their first record,
+# the DataFrame is indexed by the data row numbers
+def read_csv_rows(csv_path: str, offsets: np.ndarray, start: int, stop: int,
+                  has_header: bool = True) -> pd.DataFrame:
+    first = start + (1 if has_header else 0)
+    last = stop + (1 if has_header else 0)
+    with open(csv_path, "rb") as f:
+        f.seek(offsets[first])
+        data = f.read(offsets[last] - offsets[first])
+    df = pd.read_csv(io.BytesIO(data), header=None, skip_blank_lines=False, **READ_CSV_OPTIONS)
+    # The offsets must fall on record boundaries, otherwise the rows come out split or merged
+    if len(df) != stop - start:
+        raise ValueError(
+            f"Row index mismatch: expected {stop - start} rows from row {start} to {stop}, "
+            f"but parsed {len(df)}. The row index does not match the CSV file."
+        )
+    df.index = range(start, stop)
+    return df
+
+# Bounded queue between two pipeline stages.
+# Records the queue depth and how long each side was stalled waiting for the other.
+class PipelineQueue:
+    def __init__(self, name: str, maxsize: int):
+        self.name = name
+        self.queue = queue.Queue(maxsize)
+        # Producer waiting because the queue is full
+        self.put_stall = 0.0
+        # Consumer waiting because the queue is empty
+        self.get_stall = 0.0
+        self.max_depth = 0
+        self.total_depth = 0
+        self.puts = 0
+
+    def put(self, item) -> None:
+        start = time.perf_counter()
+        self.queue.put(item)
+        self.put_stall += time.perf_counter() - start
+        depth = self.queue.qsize()
+        self.max_depth = max(self.max_depth, depth)
+        self.total_depth += depth
+        self.puts += 1
+
+    def get(self):
+        start = time.perf_counter()
+        item = self.queue.get()
+        self.get_stall += time.perf_counter() - start
+        return item
+
+    def report(self) -> None:
+        average_depth = self.total_depth / self.puts if self.puts else 0
+        print(
+            f"\033[94m[PIPELINE] {self.name} queue: max depth {self.max_depth}/{self.queue.maxsize}, "
+            f"average depth {average_depth:.1f}, producer stalled {self.put_stall:.2f}s, "
+            f"consumer stalled {self.get_stall:.2f}s\033[0m"
+        )
+
+# Background thread prefetching chunks of chunk_size data rows through the row index.
+# Iterating it returns the chunks in file order, errors of the thread are raised here.
+class ChunkReader:
+    def __init__(self, csv_path: str, offsets: np.ndarray, chunk_size: int,
+                 has_header: bool = True, queue_depth: int = 4):
+        self.csv_path = csv_path
+        self.offsets = offsets
+        self.chunk_size = chunk_size
+        self.has_header = has_header
+        self.queue = PipelineQueue("reader", queue_depth)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        try:
+            total = row_count(self.offsets, self.has_header)
+            for start in range(0, total, self.chunk_size):
+                stop = min(start + self.chunk_size, total)
+                self.queue.put(read_csv_rows(self.csv_path, self.offsets, start, stop, self.has_header))
+        except Exception as e:
+            self.queue.put(e)
+        # None means there are no more chunks
+        self.queue.put(None)
+
+    def __iter__(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+# Background thread draining the formatted text into the output file,
+# so that writing overlaps the formatting of the next batch.
+class BackgroundWriter:
+    def __init__(self, f, queue_depth: int = 4):
+        self.f = f
+        self.error = None
+        self.queue = PipelineQueue("writer", queue_depth)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            text = self.queue.get()
+            # None means there is no more text
+            if text is None:
+                return
+            # Keep draining the queue after an error so that write() never blocks forever
+            if self.error is None:
+                try:
+                    self.f.write(text)
+                except Exception as e:
+                    self.error = e
+
+    def write(self, text: str) -> None:
+        self.queue.put(text)
+
+    # Wait until everything is written, errors of the thread are raised here
+    def close(self) -> None:
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error